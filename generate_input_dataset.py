@@ -12,16 +12,21 @@ Genera dataset para entrenamiento de la red:
 - Ventanas de 3600 s (1h) con solape de 1800 s (media hora).
 - Padding con ceros y máscara binaria.
 - Normalización global (media/STD sobre todas las grabaciones).
-- Guarda CSVs en:
+- Guarda .npy (float16, columnas dx,dy,dz) en:
       data/input/slices/
       data/input/labels/
+  y máscaras empaquetadas bit a bit (np.packbits) en:
       data/input/masks/
 - Crea data/input/norm_stats.json y data/input/manifest.csv
 """
 
-import os, glob, math, json, csv
-from datetime import timezone
-import gpxpy
+import os, sys, glob, math, json, csv
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import repeat
+import numpy as np
+from lxml import etree
 from tqdm import tqdm
 
 # ==========================================================
@@ -46,67 +51,89 @@ R_EARTH     = 6371000.0  # radio terrestre [m]
 def deg2rad(d): return d * math.pi / 180.0
 
 def to_local_xy(lat0, lon0, lat, lon):
-    """Proyección equirectangular local (m)."""
+    """Proyección equirectangular local (m). Acepta escalares o arrays."""
     lat0r = deg2rad(lat0)
-    x = deg2rad(lon - lon0) * math.cos(lat0r) * R_EARTH
-    y = deg2rad(lat - lat0) * R_EARTH
+    x = np.deg2rad(np.asarray(lon) - lon0) * math.cos(lat0r) * R_EARTH
+    y = np.deg2rad(np.asarray(lat) - lat0) * R_EARTH
     return x, y
 
-def read_gpx_points(path):
-    """Devuelve lista de puntos con lat, lon, ele, time."""
-    with open(path, "r", encoding="utf-8") as f:
-        gpx = gpxpy.parse(f)
-    pts = []
-    if not gpx.tracks: return pts
-    trk = gpx.tracks[0]
-    if not trk.segments: return pts
-    seg = trk.segments[0]
-    for p in seg.points:
-        t = p.time
-        if t is None: 
-            continue
-        if t.tzinfo is None:
-            t = t.replace(tzinfo=timezone.utc)
-        ele = p.elevation if p.elevation is not None else (0.0 if USE_Z else None)
-        pts.append({"lat": p.latitude, "lon": p.longitude, "ele": ele, "time": t})
-    return pts
-
-def build_time_index(points):
-    """Mapea segundo UNIX -> punto."""
-    return {int(p["time"].timestamp()): p for p in points}
-
-def common_time_range(a, b):
+def _parse_gpx_time(text):
+    """Convierte el texto de <time> a epoch en nanosegundos (int)."""
+    t = datetime.fromisoformat(text.strip())
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() * 1e9)
+
+def _fast_read_gpx(path):
+    """Lee los trkpt del primer segmento de un GPX con lxml.iterparse.
+
+    Devuelve arrays (lat, lon, ele, t_ns): ele con NaN donde falta y
+    t_ns en nanosegundos epoch int64 (-1 si el punto no tiene <time>)."""
+    lats, lons, eles, t_ns = [], [], [], []
+    for _, elem in etree.iterparse(path, events=("end",),
+                                   tag=("{*}trkpt", "{*}trkseg")):
+        if etree.QName(elem).localname == "trkseg":
+            break  # sólo el primer segmento
+        lats.append(float(elem.get("lat")))
+        lons.append(float(elem.get("lon")))
+        ele = None
+        tim = None
+        for child in elem:
+            tag = etree.QName(child).localname
+            if tag == "ele":
+                ele = child.text
+            elif tag == "time":
+                tim = child.text
+        eles.append(float(ele) if ele is not None else math.nan)
+        t_ns.append(_parse_gpx_time(tim) if tim else -1)
+        elem.clear()
+    return (np.array(lats), np.array(lons), np.array(eles),
+            np.array(t_ns, dtype=np.int64))
+
+@lru_cache(maxsize=None)
+def read_track_arrays(path):
+    """Lee un GPX como arrays SoA (lat, lon, ele, t_s), con t_s en
+    segundos epoch int64 y descartando los puntos sin tiempo.
+
+    Memoizado por ruta: cada fichero se parsea como mucho una vez por
+    proceso (los consumidores no mutan los arrays devueltos)."""
+    lat, lon, ele, t_ns = _fast_read_gpx(path)
+    has_t = t_ns >= 0
+    lat, lon, ele, t_ns = lat[has_t], lon[has_t], ele[has_t], t_ns[has_t]
+    ele = np.where(np.isnan(ele), 0.0, ele) if USE_Z else np.zeros_like(ele)
+    t_s = t_ns // 1_000_000_000
+    return lat, lon, ele, t_s
+
+def common_time_range(ta, tb):
     """Devuelve rango [t0, t1] de solape común (en epoch segundos)."""
-    if not a or not b: return (None, None)
-    ta0, ta1 = min(a), max(a)
-    tb0, tb1 = min(b), max(b)
-    t0, t1 = max(ta0, tb0), min(ta1, tb1)
+    if len(ta) == 0 or len(tb) == 0: return (None, None)
+    t0 = int(max(ta.min(), tb.min()))
+    t1 = int(min(ta.max(), tb.max()))
     return (t0, t1) if (t1 - t0) >= 1 else (None, None)
 
-def to_seq(idx, lat0, lon0, t0, t1):
-    """Convierte índice GPX -> secuencias x,y,z,t (1 Hz)."""
-    xs, ys, zs, ts = [], [], [], []
-    last = None
-    for t in range(t0, t1 + 1):
-        p = idx.get(t, last)
-        if p is None:
-            xs.append(math.nan); ys.append(math.nan); zs.append(0.0); ts.append(t)
-            continue
-        x, y = to_local_xy(lat0, lon0, p["lat"], p["lon"])
-        z = p["ele"] if USE_Z and p["ele"] is not None else 0.0
-        xs.append(x); ys.append(y); zs.append(z); ts.append(t)
-        last = p
-    return xs, ys, zs, ts
+def to_seq(lat, lon, ele, t_s, lat0, lon0, t0, t1):
+    """Convierte un track SoA -> secuencias x,y,z,t (1 Hz).
+
+    El índice del último punto visto en cada segundo sale de un único
+    np.searchsorted (el equivalente vectorizado del antiguo
+    dict.get(t, last)); los segundos anteriores al primer punto quedan
+    en NaN."""
+    t_grid = np.arange(t0, t1 + 1, dtype=np.int64)
+    idx = np.searchsorted(t_s, t_grid, side="right") - 1
+    have = idx >= 0
+    idx_c = np.clip(idx, 0, len(t_s) - 1)
+    la = np.where(have, lat[idx_c], math.nan)
+    lo = np.where(have, lon[idx_c], math.nan)
+    zs = np.where(have, ele[idx_c], 0.0)
+    xs, ys = to_local_xy(lat0, lon0, la, lo)
+    return xs, ys, zs, t_grid
 
 def deltas(xs, ys, zs):
-    """Calcula deltas consecutivos."""
-    n = len(xs)
-    dx = [0]*n; dy = [0]*n; dz = [0]*n
-    for i in range(1, n):
-        dx[i] = xs[i] - xs[i-1]
-        dy[i] = ys[i] - ys[i-1]
-        dz[i] = zs[i] - zs[i-1]
-    return dx, dy, dz
+    """Calcula deltas consecutivos (el primero queda a 0)."""
+    xs = np.asarray(xs); ys = np.asarray(ys); zs = np.asarray(zs)
+    return (np.diff(xs, prepend=xs[0]),
+            np.diff(ys, prepend=ys[0]),
+            np.diff(zs, prepend=zs[0]))
 
 # ==========================================================
 # Utilidades varias
@@ -122,73 +149,94 @@ def window_indices(n, win, step):
         start += step; k += 1
     return out
 
-def pad(rows, win):
-    """Rellena con ceros hasta win puntos."""
-    m = len(rows)
-    if m >= win:
-        return rows[:win], [1]*win
-    padrows = rows + [[rows[-1][0]+i+1, 0, 0, 0] for i in range(win - m)]
-    mask = [1]*m + [0]*(win - m)
-    return padrows, mask
-
-def norm(v, m, s): 
-    return 0.0 if s <= 1e-12 else (v - m) / s
+def norm(v, m, s):
+    """Normaliza v (escalar o array); con desviación ~0 devuelve 0."""
+    v = np.asarray(v)
+    return np.zeros_like(v) if s <= 1e-12 else (v - m) / s
 
-def save_csv(path, header, rows):
+def save_npy(path, arr):
+    """Guarda un array en .npy binario (~10x más compacto que el CSV
+    equivalente y sin coste de formateo de texto)."""
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(",".join(header) + "\n")
-        for r in rows:
-            f.write(",".join(str(x) for x in r) + "\n")
+    np.save(path, arr)
 
 def ensure_dirs():
     for d in [SLICES_DIR, LABELS_DIR, MASKS_DIR]:
         os.makedirs(d, exist_ok=True)
 
 # ==========================================================
-# PASO 1: calcular estadísticas globales
+# PASO 1: recorrido único (parsea cada GPX exactamente una vez)
 # ==========================================================
-def pass1_stats():
+def _collect_pasada(pdir):
+    """Parsea una pasada entera una sola vez.
+
+    Devuelve (records, parciales): records con los deltas sin normalizar
+    de cada grabación (para generar los CSV después) y parciales
+    (sum, sum2, count) para las estadísticas globales."""
     sumx=sumy=sumz=sum2x=sum2y=sum2z=0.0
     count=0
-    pasadas=[d for d in sorted(os.listdir(PRE_DIR)) if os.path.isdir(os.path.join(PRE_DIR,d))]
-    for pasada in tqdm(pasadas, desc="Pass1: global stats"):
-        pdir=os.path.join(PRE_DIR,pasada)
-        pattern=glob.glob(os.path.join(pdir,"*_pattern_aligned_resampled.gpx"))
-        if not pattern:
-            pattern=glob.glob(os.path.join(pdir,"*pattern*resampled.gpx"))
-            
-        if not pattern: continue
-        
-        trp_path=pattern[0]
-        trp_pts=read_gpx_points(trp_path)
-        if len(trp_pts)<2: continue
-        
-        lat0,lon0=trp_pts[0]["lat"],trp_pts[0]["lon"]
-        trp_idx=build_time_index(trp_pts)
-        recs=[p for p in glob.glob(os.path.join(pdir,"*_resampled.gpx"))
-              if os.path.basename(p)!=os.path.basename(trp_path)]
-        for rp in recs:
-            rec_pts=read_gpx_points(rp)
-            if len(rec_pts)<2: continue
-            rec_idx=build_time_index(rec_pts)
-            t0,t1=common_time_range(trp_idx,rec_idx)
-            if t0 is None: continue
-            
-            xg,yg,zg,tg=to_seq(rec_idx,lat0,lon0,t0,t1)
-            valid=[i for i in range(len(xg)) if not math.isnan(xg[i]) and not math.isnan(yg[i])]
-            if len(valid)<2: continue
-            
-            xg=[xg[i] for i in valid]; yg=[yg[i] for i in valid]; zg=[zg[i] for i in valid]
-            dx,dy,dz=deltas(xg,yg,zg)
-            for a,b,c in zip(dx,dy,dz):
-                sumx+=a; sumy+=b; sumz+=c
-                sum2x+=a*a; sum2y+=b*b; sum2z+=c*c
-                count+=1
+    records=[]
+    pasada=os.path.basename(pdir.rstrip(os.sep))
+    empty=(records,(sumx,sumy,sumz,sum2x,sum2y,sum2z,count))
+
+    pattern_files=glob.glob(os.path.join(pdir,"*_pattern_aligned_resampled.gpx"))
+    if not pattern_files:
+        pattern_files=glob.glob(os.path.join(pdir,"*pattern*resampled.gpx"))
+
+    if not pattern_files: return empty
+
+    trp_path=pattern_files[0]
+    plat,plon,pele,pts_t=read_track_arrays(trp_path)
+    if len(plat)<2: return empty
+
+    lat0,lon0=plat[0],plon[0]
+    pattern_name=os.path.splitext(os.path.basename(trp_path))[0]
+    recs=[p for p in glob.glob(os.path.join(pdir,"*_resampled.gpx"))
+          if os.path.basename(p)!=os.path.basename(trp_path)]
+    for rp in recs:
+        rec_name=os.path.splitext(os.path.basename(rp))[0]
+        rlat,rlon,rele,rts=read_track_arrays(rp)
+        if len(rlat)<2: continue
+
+        t0,t1=common_time_range(pts_t,rts)
+        if t0 is None: continue
+
+        xp,yp,zp,tp=to_seq(plat,plon,pele,pts_t,lat0,lon0,t0,t1)
+        xg,yg,zg,tg=to_seq(rlat,rlon,rele,rts,lat0,lon0,t0,t1)
+
+        # Estadísticas: sólo exige grabación válida (como el pass1 antiguo)
+        valid_g=~(np.isnan(xg)|np.isnan(yg))
+        if valid_g.sum()>=2:
+            dx,dy,dz=deltas(xg[valid_g],yg[valid_g],zg[valid_g])
+            sumx+=dx.sum(); sumy+=dy.sum(); sumz+=dz.sum()
+            sum2x+=(dx*dx).sum(); sum2y+=(dy*dy).sum(); sum2z+=(dz*dz).sum()
+            count+=len(dx)
+
+        # Dataset: exige grabación y patrón válidos en el mismo segundo
+        valid=valid_g&~(np.isnan(xp)|np.isnan(yp))
+        if valid.sum()<2: continue
+
+        xp=xp[valid]; yp=yp[valid]; zp=zp[valid]; tp=tp[valid]
+        xg=xg[valid]; yg=yg[valid]; zg=zg[valid]
+        dxp,dyp,dzp=deltas(xp,yp,zp)
+        dxg,dyg,dzg=deltas(xg,yg,zg)
+        src_mtime=max(os.path.getmtime(trp_path),os.path.getmtime(rp))
+        records.append((pasada,rec_name,pattern_name,tp,
+                        dxp,dyp,dzp,dxg,dyg,dzg,src_mtime))
+    return (records,(sumx,sumy,sumz,sum2x,sum2y,sum2z,count))
+
+def finalize_stats(partials):
+    """Funde los acumulados parciales en las estadísticas globales."""
+    sumx=sumy=sumz=sum2x=sum2y=sum2z=0.0
+    count=0
+    for px,py,pz,p2x,p2y,p2z,pc in partials:
+        sumx+=px; sumy+=py; sumz+=pz
+        sum2x+=p2x; sum2y+=p2y; sum2z+=p2z
+        count+=pc
     if count==0:
         return {"mean":{"dx":0,"dy":0,"dz":0},"std":{"dx":1,"dy":1,"dz":1},"count":0}
-        
-    meanx=sumx/count; meany=sumy/count; meanz=sumz/count
+
+    meanx=float(sumx)/count; meany=float(sumy)/count; meanz=float(sumz)/count
     stdx=math.sqrt(max(1e-12,(sum2x/count)-meanx**2))
     stdy=math.sqrt(max(1e-12,(sum2y/count)-meany**2))
     stdz=math.sqrt(max(1e-12,(sum2z/count)-meanz**2))
@@ -197,99 +245,99 @@ def pass1_stats():
             "count":count}
 
 # ==========================================================
-# PASO 2: generar CSVs y manifest
+# PASO 2: generar CSVs y manifest desde los deltas cacheados
 # ==========================================================
-def pass2_generate_csvs(stats):
+def _emit_record(record,stats,force=False):
+    """Normaliza, trocea en ventanas y escribe los CSV de una grabación.
+    Devuelve sus filas de manifest. No vuelve a tocar los GPX.
+
+    Con force=False las ventanas cuyas salidas ya existen y son más
+    recientes que los GPX de origen no se reescriben (el manifest sí se
+    regenera entero, que es barato)."""
+    pasada,rec_name,pattern_name,tp,dxp,dyp,dzp,dxg,dyg,dzg,src_mtime=record
     mean,std=stats["mean"],stats["std"]
     manifest=[]
-    pasadas=[d for d in sorted(os.listdir(PRE_DIR)) if os.path.isdir(os.path.join(PRE_DIR,d))]
-    for pasada in tqdm(pasadas, desc="Pass2: generar CSVs"):
-        pdir=os.path.join(PRE_DIR,pasada)
-        pattern_files=glob.glob(os.path.join(pdir,"*_pattern_aligned_resampled.gpx"))
-        if not pattern_files:
-            pattern_files=glob.glob(os.path.join(pdir,"*pattern*resampled.gpx"))
-            
-        if not pattern_files: continue
-        
-        trp_path=pattern_files[0]
-        trp_pts=read_gpx_points(trp_path)
-        if len(trp_pts)<2: continue
-        
-        lat0,lon0=trp_pts[0]["lat"],trp_pts[0]["lon"]
-        trp_idx=build_time_index(trp_pts)
-        pattern_name=os.path.splitext(os.path.basename(trp_path))[0]
-        recs=[p for p in glob.glob(os.path.join(pdir,"*_resampled.gpx"))
-              if os.path.basename(p)!=os.path.basename(trp_path)]
-        for rp in recs:
-            rec_name=os.path.splitext(os.path.basename(rp))[0]
-            rec_pts=read_gpx_points(rp)
-            if len(rec_pts)<2: continue
-            
-            rec_idx=build_time_index(rec_pts)
-            t0,t1=common_time_range(trp_idx,rec_idx)
-            if t0 is None: continue
-            
-            xp,yp,zp,tp=to_seq(trp_idx,lat0,lon0,t0,t1)
-            xg,yg,zg,tg=to_seq(rec_idx,lat0,lon0,t0,t1)
-            valid=[i for i in range(len(xg)) if not (math.isnan(xg[i]) or math.isnan(yg[i]) or math.isnan(xp[i]) or math.isnan(yp[i]))]
-            if len(valid)<2: continue
-            
-            xp=[xp[i] for i in valid]; yp=[yp[i] for i in valid]; zp=[zp[i] for i in valid]; tp=[tp[i] for i in valid]
-            xg=[xg[i] for i in valid]; yg=[yg[i] for i in valid]; zg=[zg[i] for i in valid]; tg=[tg[i] for i in valid]
-            dxp,dyp,dzp=deltas(xp,yp,zp)
-            dxg,dyg,dzg=deltas(xg,yg,zg)
-            dxp=[norm(v,mean["dx"],std["dx"]) for v in dxp]
-            dyp=[norm(v,mean["dy"],std["dy"]) for v in dyp]
-            dzp=[norm(v,mean["dz"],std["dz"]) for v in dzp]
-            dxg=[norm(v,mean["dx"],std["dx"]) for v in dxg]
-            dyg=[norm(v,mean["dy"],std["dy"]) for v in dyg]
-            dzg=[norm(v,mean["dz"],std["dz"]) for v in dzg]
-            n=len(tp)
-            for k,(i0,i1,suf) in enumerate(window_indices(n,WINDOW_SIZE,STEP_SIZE),start=1):
-                rows_lab=[[i-i0,dxp[i],dyp[i],dzp[i]] for i in range(i0,i1+1)]
-                rows_slc=[[i-i0,dxg[i],dyg[i],dzg[i]] for i in range(i0,i1+1)]
-                rows_lab,mask_lab=pad(rows_lab,WINDOW_SIZE)
-                rows_slc,mask_slc=pad(rows_slc,WINDOW_SIZE)
-                for i in range(WINDOW_SIZE):
-                    rows_lab[i][0]=i; rows_slc[i][0]=i
-                tag=f"{k}{suf}"
-                label_fn=f"{pattern_name}_{tag}.csv"
-                slice_fn=f"{rec_name}_{tag}.csv"
-                label_path=os.path.join(LABELS_DIR,label_fn)
-                slice_path=os.path.join(SLICES_DIR,slice_fn)
-                mask_path =os.path.join(MASKS_DIR,slice_fn)
-                save_csv(label_path,["time","dx","dy","dz"],rows_lab)
-                save_csv(slice_path,["time","dx","dy","dz"],rows_slc)
-                save_csv(mask_path,["mask"],[[m] for m in mask_slc])
-                manifest.append([
-                    pasada, rec_name, pattern_name, tag,
-                    tp[i0], tp[min(i1,len(tp)-1)],
-                    slice_path, label_path, mask_path,
-                    len(rows_slc)
-                ])
-                
-    # escribir manifest
-    with open(MANIFEST_PATH,"w",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        w.writerow(["pasada","grabacion","pattern","window_id","t_start","t_end",
-                    "slice_path","label_path","mask_path","n_points"])
-        w.writerows(manifest)
+    dxp=norm(dxp,mean["dx"],std["dx"])
+    dyp=norm(dyp,mean["dy"],std["dy"])
+    dzp=norm(dzp,mean["dz"],std["dz"])
+    dxg=norm(dxg,mean["dx"],std["dx"])
+    dyg=norm(dyg,mean["dy"],std["dy"])
+    dzg=norm(dzg,mean["dz"],std["dz"])
+    n=len(tp)
+    # Matrices (n,3) completas; cada ventana es una vista + np.pad.
+    # El índice de segundo dentro de la ventana es implícito (la fila).
+    lab=np.stack([dxp,dyp,dzp],axis=1).astype(np.float32)
+    slc=np.stack([dxg,dyg,dzg],axis=1).astype(np.float32)
+    for k,(i0,i1,suf) in enumerate(window_indices(n,WINDOW_SIZE,STEP_SIZE),start=1):
+        m=i1-i0+1
+        tag=f"{k}{suf}"
+        label_fn=f"{pattern_name}_{tag}.npy"
+        slice_fn=f"{rec_name}_{tag}.npy"
+        label_path=os.path.join(LABELS_DIR,label_fn)
+        slice_path=os.path.join(SLICES_DIR,slice_fn)
+        mask_path =os.path.join(MASKS_DIR,slice_fn)
+        outs=(slice_path,label_path,mask_path)
+        fresh=(not force and all(os.path.exists(p) for p in outs)
+               and min(os.path.getmtime(p) for p in outs)>src_mtime)
+        if not fresh:
+            rows_lab=np.pad(lab[i0:i1+1],((0,WINDOW_SIZE-m),(0,0)))
+            rows_slc=np.pad(slc[i0:i1+1],((0,WINDOW_SIZE-m),(0,0)))
+            # Máscara binaria empaquetada: np.unpackbits(...)[:WINDOW_SIZE]
+            # recupera el vector original
+            mask_slc=np.concatenate([np.ones(m,dtype=np.uint8),
+                                     np.zeros(WINDOW_SIZE-m,dtype=np.uint8)])
+            save_npy(label_path,rows_lab.astype(np.float16))
+            save_npy(slice_path,rows_slc.astype(np.float16))
+            save_npy(mask_path,np.packbits(mask_slc))
+        manifest.append([
+            pasada, rec_name, pattern_name, tag,
+            tp[i0], tp[min(i1,len(tp)-1)],
+            slice_path, label_path, mask_path,
+            WINDOW_SIZE
+        ])
+    return manifest
 
 # ==========================================================
 # MAIN
 # ==========================================================
 def main():
+    force = "--force" in sys.argv[1:]
     ensure_dirs()
-    
-    # Paso 1: estadísticas globales
-    stats = pass1_stats()
+
+    pasadas=[d for d in sorted(os.listdir(PRE_DIR)) if os.path.isdir(os.path.join(PRE_DIR,d))]
+    pdirs=[os.path.join(PRE_DIR,p) for p in pasadas]
+
+    # Recorrido único: cada GPX se parsea exactamente una vez y los
+    # deltas sin normalizar quedan cacheados en RAM
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        collected=list(tqdm(ex.map(_collect_pasada,pdirs),
+                            total=len(pdirs), desc="Parsear GPX"))
+    records=[r for recs,_ in collected for r in recs]
+    stats=finalize_stats([part for _,part in collected])
+
     os.makedirs(OUT_DIR, exist_ok=True)
-    with open(os.path.join(OUT_DIR,"norm_stats.json"),"w",encoding="utf-8") as f:
+    stats_path=os.path.join(OUT_DIR,"norm_stats.json")
+    # Si las estadísticas globales cambiaron, las salidas antiguas están
+    # normalizadas con otros valores: hay que reescribirlas todas.
+    if not force and os.path.exists(stats_path):
+        with open(stats_path,"r",encoding="utf-8") as f:
+            if json.load(f)!=stats:
+                force=True
+    with open(stats_path,"w",encoding="utf-8") as f:
         json.dump(stats,f,indent=2)
     print("Norm stats:", stats)
-    
-    # Paso 2: generación
-    pass2_generate_csvs(stats)
+
+    # Generación de CSVs desde los deltas cacheados
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        per_record=list(tqdm(ex.map(_emit_record,records,repeat(stats),repeat(force)),
+                             total=len(records), desc="Generar CSVs"))
+    manifest=[row for rows in per_record for row in rows]
+
+    with open(MANIFEST_PATH,"w",newline="",encoding="utf-8") as f:
+        w=csv.writer(f)
+        w.writerow(["pasada","grabacion","pattern","window_id","t_start","t_end",
+                    "slice_path","label_path","mask_path","n_points"])
+        w.writerows(manifest)
     print(f"✅ Dataset generado en {OUT_DIR}")
 
 if __name__ == "__main__":
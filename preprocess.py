@@ -24,18 +24,23 @@ data/
 """
 
 import os
+import sys
 import math
 import glob
 import time
-import gpxpy
-import gpxpy.gpx
-from tqdm import tqdm
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import numpy as np
+from lxml import etree
+from numba import njit
+from scipy.spatial import cKDTree
+from datetime import datetime, timezone
 
 RAW_DIR = os.path.join("data", "raw")
 PRE_DIR = os.path.join("data", "preprocessed")
 
 R_EARTH = 6371000.0  # Radio terrestre medio [m]
+NS = 1_000_000_000   # nanosegundos por segundo
 
 # -------------------------------------------------------
 # Utilidades geométricas y de proyección
@@ -43,10 +48,13 @@ R_EARTH = 6371000.0  # Radio terrestre medio [m]
 def deg2rad(d): return d * math.pi / 180.0
 
 def local_xy(lat0, lon0, lat, lon):
-    """Proyección equirectangular local centrada en (lat0, lon0)."""
+    """Proyección equirectangular local centrada en (lat0, lon0).
+
+    Acepta escalares o arrays NumPy: con arrays calcula todos los puntos
+    en una sola expresión vectorizada."""
     lat0r = deg2rad(lat0)
-    x = deg2rad(lon - lon0) * math.cos(lat0r) * R_EARTH
-    y = deg2rad(lat - lat0) * R_EARTH
+    x = np.deg2rad(np.asarray(lon) - lon0) * math.cos(lat0r) * R_EARTH
+    y = np.deg2rad(np.asarray(lat) - lat0) * R_EARTH
     return x, y
 
 def point_segment_projection(px, py, ax, ay, bx, by):
@@ -65,122 +73,252 @@ def point_segment_projection(px, py, ax, ay, bx, by):
 # -------------------------------------------------------
 # GPX helpers
 # -------------------------------------------------------
+def _parse_gpx_time(text):
+    """Convierte el texto de <time> a epoch en nanosegundos (int)."""
+    t = datetime.fromisoformat(text.strip())
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() * 1e9)
+
+def _fast_read_gpx(path):
+    """Lee los trkpt del primer track de un GPX con lxml.iterparse.
+
+    Devuelve arrays (lat, lon, ele, t_ns): ele con NaN donde falta y
+    t_ns en nanosegundos epoch int64 (-1 si el punto no tiene <time>).
+    Evita el grafo de objetos por punto que construye gpxpy."""
+    lats, lons, eles, t_ns = [], [], [], []
+    for _, elem in etree.iterparse(path, events=("end",),
+                                   tag=("{*}trkpt", "{*}trk")):
+        if etree.QName(elem).localname == "trk":
+            break  # sólo el primer track
+        lats.append(float(elem.get("lat")))
+        lons.append(float(elem.get("lon")))
+        ele = None
+        tim = None
+        for child in elem:
+            tag = etree.QName(child).localname
+            if tag == "ele":
+                ele = child.text
+            elif tag == "time":
+                tim = child.text
+        eles.append(float(ele) if ele is not None else math.nan)
+        t_ns.append(_parse_gpx_time(tim) if tim else -1)
+        elem.clear()
+    return (np.array(lats), np.array(lons), np.array(eles),
+            np.array(t_ns, dtype=np.int64))
+
+def outputs_up_to_date(in_paths, out_paths):
+    """True si todas las salidas existen y son más recientes que la
+    entrada más nueva (ejecución incremental)."""
+    if not all(os.path.exists(p) for p in out_paths):
+        return False
+    newest_in = max(os.path.getmtime(p) for p in in_paths)
+    oldest_out = min(os.path.getmtime(p) for p in out_paths)
+    return oldest_out > newest_in
+
 def read_gpx_points(path):
-    """Lee puntos de un GPX (primer track y segmento)."""
-    with open(path, "r", encoding="utf-8") as f:
-        gpx = gpxpy.parse(f)
+    """Lee puntos de un GPX (primer track).
+
+    El campo "time" es epoch en nanosegundos (int) o None: todo el
+    pipeline trabaja en ns y sólo se convierte a datetime al escribir."""
+    lat, lon, ele, t_ns = _fast_read_gpx(path)
     points = []
-    if not gpx.tracks:
-        return points
-    for trk in gpx.tracks:
-        for seg in trk.segments:
-            for p in seg.points:
-                t = p.time
-                if t is not None and t.tzinfo is None:
-                    t = t.replace(tzinfo=timezone.utc)
-                points.append({
-                    "lat": p.latitude,
-                    "lon": p.longitude,
-                    "ele": p.elevation,
-                    "time": t
-                })
-        break
+    for i in range(len(lat)):
+        points.append({
+            "lat": lat[i],
+            "lon": lon[i],
+            "ele": None if math.isnan(ele[i]) else ele[i],
+            "time": int(t_ns[i]) if t_ns[i] >= 0 else None
+        })
     return points
 
+def _format_gpx_time(t_ns):
+    """Formatea un epoch en nanosegundos como tiempo GPX (ISO-8601 Z).
+    Única frontera donde se vuelve a construir un datetime."""
+    t = datetime.fromtimestamp(t_ns / 1e9, tz=timezone.utc)
+    if t.microsecond:
+        frac = f".{t.microsecond:06d}".rstrip("0")
+        return t.strftime("%Y-%m-%dT%H:%M:%S") + frac + "Z"
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
 def write_gpx_points(path, name, points):
-    """Escribe puntos en un GPX."""
-    gpx = gpxpy.gpx.GPX()
-    trk = gpxpy.gpx.GPXTrack(name=name)
-    gpx.tracks.append(trk)
-    seg = gpxpy.gpx.GPXTrackSegment()
-    trk.segments.append(seg)
+    """Escribe puntos en un GPX (serialización directa con str.join,
+    sin construir objetos gpxpy por punto)."""
+    rows = []
     for p in points:
-        seg.points.append(gpxpy.gpx.GPXTrackPoint(
-            p["lat"], p["lon"], elevation=p.get("ele"), time=p.get("time")
-        ))
+        s = f'      <trkpt lat="{float(p["lat"])!r}" lon="{float(p["lon"])!r}">'
+        ele = p.get("ele")
+        if ele is not None:
+            s += f"<ele>{float(ele)!r}</ele>"
+        t = p.get("time")
+        if t is not None:
+            s += f"<time>{_format_gpx_time(t)}</time>"
+        s += "</trkpt>"
+        rows.append(s)
+    body = "\n".join(rows)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        f.write(gpx.to_xml())
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" '
+                'creator="tracks-preprocess">\n'
+                f"  <trk>\n    <name>{name}</name>\n    <trkseg>\n"
+                f"{body}\n"
+                "    </trkseg>\n  </trk>\n</gpx>\n")
 
 # -------------------------------------------------------
 # Resample a 1 Hz
 # -------------------------------------------------------
-def interpolate_point(pA, pB, t_target):
-    """Interpola posición linealmente para el tiempo t_target."""
-    tA, tB = pA["time"], pB["time"]
-    if tA is None or tB is None:
-        return {"lat": pA["lat"], "lon": pA["lon"], "ele": pA["ele"], "time": t_target}
-    total = (tB - tA).total_seconds()
-    if total <= 0:
-        return {"lat": pA["lat"], "lon": pA["lon"], "ele": pA["ele"], "time": t_target}
-    alpha = (t_target - tA).total_seconds() / total
-    alpha = max(0.0, min(1.0, alpha))
-    lat = pA["lat"] + alpha * (pB["lat"] - pA["lat"])
-    lon = pA["lon"] + alpha * (pB["lon"] - pA["lon"])
-    ele = None
-    if pA["ele"] is not None and pB["ele"] is not None:
-        ele = pA["ele"] + alpha * (pB["ele"] - pA["ele"])
-    return {"lat": lat, "lon": lon, "ele": ele, "time": t_target}
-
 def resample_1hz(points):
-    """Devuelve puntos a 1 Hz (interpolando linealmente)."""
+    """Devuelve puntos a 1 Hz (interpolación lineal vectorizada).
+
+    np.interp hace la interpolación de toda la rejilla de segundos en
+    una sola pasada C y ya recorta en los extremos al valor más cercano."""
     pts = [p for p in points if p["time"] is not None]
     if len(pts) < 2:
         return pts
     pts = sorted(pts, key=lambda p: p["time"])
-    t0, t1 = pts[0]["time"], pts[-1]["time"]
-    start = t0.replace(microsecond=0)
-    end = t1.replace(microsecond=0)
+    t = np.array([p["time"] for p in pts], dtype=np.int64)
+    lat = np.array([p["lat"] for p in pts])
+    lon = np.array([p["lon"] for p in pts])
+    ele = np.array([p["ele"] if p["ele"] is not None else math.nan
+                    for p in pts])
+    t_grid = np.arange((t[0] // NS) * NS, (t[-1] // NS) * NS + 1, NS,
+                       dtype=np.int64)
+    # Un único searchsorted localiza el segmento de cada segundo y las
+    # tres coordenadas comparten índice y fracción (np.interp repetiría
+    # la búsqueda binaria por cada canal). Las restas entre int64
+    # cercanos son exactas, sin pérdida de precisión al pasar a float64.
+    idx = np.searchsorted(t, t_grid, side="right") - 1
+    idx = np.clip(idx, 0, len(t) - 2)
+    denom = (t[idx + 1] - t[idx]).astype(np.float64)
+    alpha = (t_grid - t[idx]).astype(np.float64)
+    alpha = np.where(denom > 0, alpha / np.where(denom > 0, denom, 1.0), 0.0)
+    alpha = np.clip(alpha, 0.0, 1.0)  # recorte al valor más cercano fuera de rango
+    lat_r = lat[idx] + alpha * (lat[idx + 1] - lat[idx])
+    lon_r = lon[idx] + alpha * (lon[idx + 1] - lon[idx])
+    good = ~np.isnan(ele)
+    if good.sum() < 2:
+        ele_r = None
+    elif good.all():
+        ele_r = ele[idx] + alpha * (ele[idx + 1] - ele[idx])
+    else:
+        # Con huecos de elevación la rejilla de tiempos es otra:
+        # interpolación aparte sólo sobre los puntos con <ele>
+        rel = (t - t_grid[0]).astype(np.float64)
+        rel_grid = (t_grid - t_grid[0]).astype(np.float64)
+        ele_r = np.interp(rel_grid, rel[good], ele[good])
     res = []
-    i = 0
-    t = start
-    while t <= end:
-        while i + 1 < len(pts) and pts[i+1]["time"] < t:
-            i += 1
-        if i + 1 < len(pts) and pts[i]["time"] <= t <= pts[i+1]["time"]:
-            res.append(interpolate_point(pts[i], pts[i+1], t))
-        else:
-            nearest = pts[0] if t < pts[0]["time"] else pts[-1]
-            res.append({"lat": nearest["lat"], "lon": nearest["lon"], "ele": nearest["ele"], "time": t})
-        t += timedelta(seconds=1)
+    for i, ts in enumerate(t_grid):
+        res.append({
+            "lat": lat_r[i],
+            "lon": lon_r[i],
+            "ele": ele_r[i] if ele_r is not None else None,
+            "time": int(ts)
+        })
     return res
 
 # -------------------------------------------------------
 # Ajuste del instante más cercano (interpolación real)
 # -------------------------------------------------------
-def closest_time_via_segment_interp(pp, tr_points):
-    """Busca el segmento más cercano e interpola el tiempo según u."""
-    lat0, lon0 = pp["lat"], pp["lon"]
-    XY = [local_xy(lat0, lon0, p["lat"], p["lon"]) for p in tr_points]
-
-    best = None
-    for i in range(len(tr_points) - 1):
-        A, B = tr_points[i], tr_points[i+1]
-        (ax, ay), (bx, by) = XY[i], XY[i+1]
-        u, _, _, dist = point_segment_projection(0.0, 0.0, ax, ay, bx, by)
-        if 0.0 <= u <= 1.0:
-            tA, tB = A["time"], B["time"]
-            if tA is None or tB is None:
-                continue
-            t_interp = tA + (tB - tA) * u
-            if best is None or dist < best[0]:
-                best = (dist, t_interp)
-
-    if best is None:
-        for i, P in enumerate(tr_points):
-            x, y = XY[i]
-            dist = math.hypot(x, y)
-            if P["time"] is None:
-                continue
-            if best is None or dist < best[0]:
-                best = (dist, P["time"])
-
-    return best[1] if best else None
+KDTREE_K = 8  # nº de segmentos candidatos por consulta al KD-tree
+
+def build_track_segments(tr_points, lat0, lon0):
+    """Precalcula la geometría de segmentos de un track en un marco local
+    fijo centrado en (lat0, lon0) y un KD-tree de puntos medios para
+    buscar candidatos. Devuelve None si no hay segmentos con tiempo."""
+    pts = [p for p in tr_points if p["time"] is not None]
+    if len(pts) < 2:
+        return None
+    lat = np.array([p["lat"] for p in pts])
+    lon = np.array([p["lon"] for p in pts])
+    x, y = local_xy(lat0, lon0, lat, lon)
+    t = np.array([p["time"] for p in pts], dtype=np.int64)
+    seg = {
+        "x": x, "y": y, "t": t,
+        "ax": x[:-1], "ay": y[:-1], "bx": x[1:], "by": y[1:],
+        "tA": t[:-1], "tB": t[1:],
+    }
+    mid = np.column_stack(((seg["ax"] + seg["bx"]) * 0.5,
+                           (seg["ay"] + seg["by"]) * 0.5))
+    seg["tree"] = cKDTree(mid)
+    return seg
+
+@njit(cache=True, fastmath=True)
+def find_nearest_segment(px, py, idx, ax, ay, bx, by, tA, tB):
+    """Proyecta (px, py) sobre los segmentos idx y devuelve (d2, t) del
+    segmento con proyección interior más cercano. t es NaN si ninguno
+    tiene proyección interior.
+
+    Compilado con Numba: el bucle corre en código máquina y evita la
+    raíz cuadrada comparando distancias al cuadrado."""
+    best_d2 = np.inf
+    best_t = np.nan
+    for k in range(idx.shape[0]):
+        i = idx[k]
+        vx = bx[i] - ax[i]
+        vy = by[i] - ay[i]
+        vv = vx*vx + vy*vy
+        if vv == 0.0:
+            continue
+        u = ((px - ax[i])*vx + (py - ay[i])*vy) / vv
+        if u < 0.0 or u > 1.0:
+            continue
+        dx = ax[i] + u*vx - px
+        dy = ay[i] + u*vy - py
+        d2 = dx*dx + dy*dy
+        if d2 < best_d2:
+            best_d2 = d2
+            best_t = tA[i] + (tB[i] - tA[i]) * u
+    return best_d2, best_t
+
+def closest_times_batch(px, py, seg):
+    """Tiempos interpolados del track para todos los puntos del patrón
+    de una sola vez.
+
+    Una única consulta al KD-tree devuelve los candidatos de todos los
+    puntos (N x k) y la proyección se evalúa con broadcasting; sólo las
+    filas sin proyección interior caen al barrido completo por punto.
+    Devuelve un array de tiempos epoch (ns)."""
+    npts = len(px)
+    nseg = len(seg["ax"])
+    k = min(KDTREE_K, nseg)
+    _, idx = seg["tree"].query(np.column_stack((px, py)), k=k)
+    idx = idx.reshape(npts, k)
+    ax, ay = seg["ax"][idx], seg["ay"][idx]
+    bx, by = seg["bx"][idx], seg["by"][idx]
+    vx, vy = bx - ax, by - ay
+    vv = vx*vx + vy*vy
+    u = (((px[:, None] - ax)*vx + (py[:, None] - ay)*vy)
+         / np.where(vv == 0.0, 1.0, vv))
+    inside = (u >= 0.0) & (u <= 1.0) & (vv > 0.0)
+    qx = ax + u*vx
+    qy = ay + u*vy
+    d2 = (px[:, None] - qx)**2 + (py[:, None] - qy)**2
+    d2 = np.where(inside, d2, np.inf)
+    best = d2.argmin(axis=1)
+    rows = np.arange(npts)
+    jbest = idx[rows, best]
+    t_out = (seg["tA"][jbest]
+             + (seg["tB"][jbest] - seg["tA"][jbest]) * u[rows, best])
+
+    # Filas sin candidato interior: barrido completo y, si tampoco hay
+    # proyección interior, vértice más cercano
+    for i in np.flatnonzero(~inside[rows, best]):
+        all_idx = np.arange(nseg, dtype=np.int64)
+        _, t_i = find_nearest_segment(px[i], py[i], all_idx,
+                                      seg["ax"], seg["ay"],
+                                      seg["bx"], seg["by"],
+                                      seg["tA"], seg["tB"])
+        if math.isnan(t_i):
+            d2v = (seg["x"] - px[i])**2 + (seg["y"] - py[i])**2
+            t_i = seg["t"][int(np.argmin(d2v))]
+        t_out[i] = t_i
+    return t_out
 
 # -------------------------------------------------------
 # Pipeline por "pasada"
 # -------------------------------------------------------
-def process_pasada(pasada_dir):
+def process_pasada(pasada_dir, force=False):
     base = os.path.basename(pasada_dir.rstrip(os.sep))
     print(f"\n🔹 Procesando pasada: {base}")
     start_time = time.time()
@@ -201,10 +339,28 @@ def process_pasada(pasada_dir):
     trp_path = pattern_files[0]
     rec_paths = [p for p in gpx_files if p != trp_path]
 
+    # Ejecución incremental: si todas las salidas son más recientes que
+    # las entradas no hay nada que rehacer (salvo con --force)
+    pattern_name = os.path.splitext(os.path.basename(trp_path))[0]
+    expected = [os.path.join(out_dir,
+                             os.path.splitext(os.path.basename(rp))[0]
+                             + "_resampled.gpx")
+                for rp in rec_paths]
+    expected.append(os.path.join(out_dir, f"{pattern_name}_aligned.gpx"))
+    if not force and outputs_up_to_date(gpx_files, expected):
+        print(f"[{base}] ⏩ Salidas al día. Saltando.")
+        return
+
     # 1️⃣ Resamplear grabaciones
+    # La lectura es sobre todo E/S (y lxml suelta el GIL al parsear):
+    # se cargan las grabaciones de la pasada en hilos, y el resampleo
+    # y la escritura siguen en orden en el proceso de la pasada.
     resampled_tracks = []
-    for rp in rec_paths:
-        pts = read_gpx_points(rp)
+    rec_pts = []
+    if rec_paths:  # una pasada sólo con patrón no levanta el pool
+        with ThreadPoolExecutor(max_workers=min(8, len(rec_paths))) as tex:
+            rec_pts = list(tex.map(read_gpx_points, rec_paths))
+    for rp, pts in zip(rec_paths, rec_pts):
         pts = [p for p in pts if p["time"] is not None]
         if len(pts) < 2:
             print(f"[{base}] ⚠️ {os.path.basename(rp)}: menos de 2 puntos válidos.")
@@ -227,20 +383,30 @@ def process_pasada(pasada_dir):
         return
 
     # 3️⃣ Ajustar tiempos
-    aligned = []
+    # Marco local único centrado en el centroide del patrón: la zona de una
+    # pasada es pequeña, así que la proyección (y su cos(lat0)) se calcula
+    # una sola vez por pasada en vez de por punto consultado.
+    pat_lat = np.array([p["lat"] for p in trp_pts])
+    pat_lon = np.array([p["lon"] for p in trp_pts])
+    lat0 = pat_lat.mean()
+    lon0 = pat_lon.mean()
+    track_segs = [s for s in (build_track_segments(tr, lat0, lon0)
+                              for tr in resampled_tracks) if s is not None]
+
+    # Proyectar todos los puntos del patrón de una vez
+    pat_x, pat_y = local_xy(lat0, lon0, pat_lat, pat_lon)
+
     print(f"[{base}] ⏱ Ajustando {len(trp_pts)} puntos del patrón...")
-    for pp in tqdm(trp_pts, desc=f"{base}", ncols=80):
-        times = []
-        for tr in resampled_tracks:
-            t_near = closest_time_via_segment_interp(pp, tr)
-            if t_near:
-                times.append(t_near)
-        if times:
-            avg_epoch = sum(t.timestamp() for t in times) / len(times)
-            tpp = datetime.fromtimestamp(avg_epoch, tz=timezone.utc)
-        else:
-            tpp = pp.get("time")
-        aligned.append({**pp, "time": tpp})
+    times_per_track = [closest_times_batch(pat_x, pat_y, seg)
+                       for seg in track_segs]
+
+    # Media entre grabaciones de una sola reducción (ns), en vez de un
+    # bucle Python por punto del patrón
+    if times_per_track:
+        t_avg = np.stack(times_per_track).mean(axis=0)
+        aligned = [{**pp, "time": t_avg[k]} for k, pp in enumerate(trp_pts)]
+    else:
+        aligned = [{**pp, "time": pp.get("time")} for pp in trp_pts]
 
     # 4️⃣ Guardar resultado
     pattern_name = os.path.splitext(os.path.basename(trp_path))[0]
@@ -254,16 +420,20 @@ def process_pasada(pasada_dir):
 # Main
 # -------------------------------------------------------
 def main():
+    force = "--force" in sys.argv[1:]
     if not os.path.isdir(RAW_DIR):
         print(f"❌ No existe {RAW_DIR}")
         return
 
     pasadas = [d for d in sorted(os.listdir(RAW_DIR))
                if os.path.isdir(os.path.join(RAW_DIR, d))]
+    pasada_paths = [os.path.join(RAW_DIR, p) for p in pasadas]
 
     print(f"📂 Encontradas {len(pasadas)} pasadas en {RAW_DIR}")
-    for pasada in pasadas:
-        process_pasada(os.path.join(RAW_DIR, pasada))
+    # Cada pasada es independiente (lee y escribe en su propio directorio):
+    # se reparten entre procesos para aprovechar todos los núcleos.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        list(ex.map(process_pasada, pasada_paths, repeat(force)))
 
 if __name__ == "__main__":
     main()
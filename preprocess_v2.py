@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, math, glob, time, bisect
-from datetime import datetime, timedelta, timezone
-import gpxpy, gpxpy.gpx
-from tqdm import tqdm
+import os, math, glob, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import numpy as np
+from lxml import etree
+from numba import njit
+from scipy.spatial import cKDTree
 
 RAW_DIR = os.path.join("data", "raw")
 PRE_DIR = os.path.join("data", "preprocessed")
@@ -19,229 +23,400 @@ R_EARTH = 6371000.0
 def deg2rad(d): return d * math.pi / 180.0
 
 def to_xy(lat0, lon0, lat, lon):
-	"""
+    """
         Convierte (lat, lon) a coordenadas planas (x, y) en metros
         usando proyección equirectangular con origen en (lat0, lon0).
+        Acepta escalares o arrays (vectorizado con NumPy).
     """
     lat0r = deg2rad(lat0)
-    x = deg2rad(lon - lon0) * math.cos(lat0r) * R_EARTH
-    y = deg2rad(lat - lat0) * R_EARTH
+    x = np.deg2rad(np.asarray(lon) - lon0) * math.cos(lat0r) * R_EARTH
+    y = np.deg2rad(np.asarray(lat) - lat0) * R_EARTH
     return x, y
 
-def proj_on_segment(px, py, ax, ay, bx, by, clamp=True):
-	"""
-	    Proyecta punto P(px,py) sobre segmento AB(ax,ay)-(bx,by).
-	    Si clamp=True, limita la proyección al segmento; si no, puede
-	    salir fuera.
-	    Devuelve (u, qx, qy, dist):
-            u: parámetro de la proyección (0 en A, 1 en B)
-            (qx, qy): coordenadas del punto proyectado
-            dist: distancia desde P al punto proyectado
-    """
-    vx, vy = bx - ax, by - ay
-    wx, wy = px - ax, py - ay
-    vv = vx*vx + vy*vy
-    if vv == 0.0:
-        u = 0.0
-        qx, qy = ax, ay
-    else:
-        u = (wx*vx + wy*vy) / vv
-        if clamp:
-            u = max(0.0, min(1.0, u))
-        qx, qy = ax + u*vx, ay + u*vy
-    dist = math.hypot(px - qx, py - qy)
-    return u, qx, qy, dist
-
 def cumdist(xs, ys):
-	"""
-	    Dada una polilínea (xs, ys), devuelve:
-	    seglen: lista de longitudes de segmentos
-	    s: lista de distancias acumuladas en cada punto del track (vértices)
-	"""
-    seglen = []
-    for i in range(len(xs) - 1):
-        seglen.append(math.hypot(xs[i+1] - xs[i], ys[i+1] - ys[i]))
-    s = [0.0]
-    for L in seglen:
-        s.append(s[-1] + L)
+    """
+        Dada una polilínea (xs, ys), devuelve:
+        seglen: array de longitudes de segmentos
+        s: array de distancias acumuladas en cada punto del track (vértices)
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    seglen = np.hypot(np.diff(xs), np.diff(ys))
+    s = np.concatenate(([0.0], np.cumsum(seglen)))
     return seglen, s  # len(seglen)=n-1, len(s)=n
 
 # ---------------- GPX helpers ----------------
+@dataclass
+class Track:
+    """
+        Track como arrays paralelos (SoA) en memoria contigua:
+        lat/lon/ele en float64 (NaN donde falta <ele>) y t en segundos
+        epoch float64 (NaN donde el punto no tiene <time>).
+    """
+    lat: np.ndarray
+    lon: np.ndarray
+    ele: np.ndarray
+    t: np.ndarray
+
+    def __len__(self):
+        return len(self.lat)
+
+def _parse_gpx_time(text):
+    """Convierte el texto de <time> a epoch en segundos (float)."""
+    t = datetime.fromisoformat(text.strip())
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+def _times_to_epoch(texts):
+    """
+        Convierte los textos ISO-8601 de <time> a epoch en segundos
+        (float64, NaN donde falta). La conversión va en bloque vía
+        datetime64[ns] (sin el sufijo Z: datetime64 no admite zona y el
+        GPX va en UTC); si aparece un offset explícito se cae al parseo
+        por punto con datetime.fromisoformat.
+    """
+    try:
+        dt = np.array([t.strip().rstrip("Zz") if t else "NaT" for t in texts],
+                      dtype="datetime64[ns]")
+    except ValueError:
+        return np.array([_parse_gpx_time(t) if t else math.nan for t in texts],
+                        dtype=np.float64)
+    return np.where(np.isnat(dt), np.nan, dt.astype(np.int64) / 1e9)
+
 def read_gpx_points(path):
-    with open(path, "r", encoding="utf-8") as f:
-        gpx = gpxpy.parse(f)
-    pts = []
-    if not gpx.tracks:
-        return pts
-    trk = gpx.tracks[0]
-    if not trk.segments:
-        return pts
-    seg = trk.segments[0]
-    for p in seg.points:
-        t = p.time
-        if t is not None and t.tzinfo is None:
-            t = t.replace(tzinfo=timezone.utc)
-        pts.append({"lat": p.latitude, "lon": p.longitude, "ele": p.elevation, "time": t})
-    return pts
-
-def write_gpx_points(path, name, points):
-    gpx = gpxpy.gpx.GPX()
-    trk = gpxpy.gpx.GPXTrack(name=name)
-    gpx.tracks.append(trk)
-    seg = gpxpy.gpx.GPXTrackSegment()
-    trk.segments.append(seg)
-    for p in points:
-        seg.points.append(gpxpy.gpx.GPXTrackPoint(
-            p["lat"], p["lon"], elevation=p.get("ele"), time=p.get("time")
-        ))
+    """
+        Lee los trkpt del primer segmento de un GPX en streaming con
+        lxml.iterparse (velocidad libxml2, sin construir el modelo de
+        objetos de gpxpy). Devuelve Track.
+    """
+    lats, lons, eles, ts = [], [], [], []
+    for _, elem in etree.iterparse(path, events=("end",),
+                                   tag=("{*}trkpt", "{*}trkseg")):
+        if etree.QName(elem).localname == "trkseg":
+            break  # sólo el primer segmento
+        lats.append(float(elem.get("lat")))
+        lons.append(float(elem.get("lon")))
+        ele = None
+        tim = None
+        for child in elem:
+            tag = etree.QName(child).localname
+            if tag == "ele":
+                ele = child.text
+            elif tag == "time":
+                tim = child.text
+        eles.append(float(ele) if ele is not None else math.nan)
+        ts.append(tim)  # texto crudo; conversión en bloque al final
+        elem.clear()
+    return Track(np.array(lats), np.array(lons), np.array(eles),
+                 _times_to_epoch(ts))
+
+def _format_gpx_time(t):
+    """Formatea un epoch en segundos como tiempo GPX (ISO-8601 con Z)."""
+    dt = datetime.fromtimestamp(t, tz=timezone.utc)
+    if dt.microsecond:
+        frac = f".{dt.microsecond:06d}".rstrip("0")
+        return dt.strftime("%Y-%m-%dT%H:%M:%S") + frac + "Z"
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def write_gpx_points(path, name, track):
+    """Escribe un Track en GPX (serialización directa con str.join,
+    sin construir objetos gpxpy por punto)."""
+    rows = []
+    for lat, lon, ele, t in zip(track.lat, track.lon, track.ele, track.t):
+        s = f'      <trkpt lat="{float(lat)!r}" lon="{float(lon)!r}">'
+        if not math.isnan(ele):
+            s += f"<ele>{float(ele)!r}</ele>"
+        if not math.isnan(t):
+            s += f"<time>{_format_gpx_time(t)}</time>"
+        s += "</trkpt>"
+        rows.append(s)
+    body = "\n".join(rows)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        f.write(gpx.to_xml())
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" '
+                'creator="tracks-preprocess">\n'
+                f"  <trk>\n    <name>{name}</name>\n    <trkseg>\n"
+                f"{body}\n"
+                "    </trkseg>\n  </trk>\n</gpx>\n")
 
 # ---------------- Resample 1 Hz ----------------
-def interpolate_point(pA, pB, t_target):
-	"""
-	   Interpola linealmente entre pA y pB para obtener punto en t_target.
-	"""
-    tA, tB = pA["time"], pB["time"]
-    if tA is None or tB is None:
-        return {"lat": pA["lat"], "lon": pA["lon"], "ele": pA["ele"], "time": t_target}
-    total = (tB - tA).total_seconds()
-    if total <= 0:
-        return {"lat": pA["lat"], "lon": pA["lon"], "ele": pA["ele"], "time": t_target}
-    a = (t_target - tA).total_seconds() / total
-    a = max(0.0, min(1.0, a))
-    lat = pA["lat"] + a*(pB["lat"] - pA["lat"])
-    lon = pA["lon"] + a*(pB["lon"] - pA["lon"])
-    ele = None
-    if pA["ele"] is not None and pB["ele"] is not None:
-        ele = pA["ele"] + a*(pB["ele"] - pA["ele"])
-    return {"lat": lat, "lon": lon, "ele": ele, "time": t_target}
-
-def resample_1hz(points):
-    pts = [p for p in points if p["time"] is not None]
-    if len(pts) < 2:
-        return pts
-    pts = sorted(pts, key=lambda p: p["time"])
-    t = pts[0]["time"].replace(microsecond=0)
-    end = pts[-1]["time"].replace(microsecond=0)
-    res, i = [], 0
-    while t <= end:
-		# Avanza i hasta que pts[i]["time"] <= t < pts[i+1]["time"]
-        while i+1 < len(pts) and pts[i+1]["time"] < t:
-            i += 1
-        if i+1 < len(pts) and pts[i]["time"] <= t <= pts[i+1]["time"]:
-            res.append(interpolate_point(pts[i], pts[i+1], t))
-        else:
-            nearest = pts[0] if t < pts[0]["time"] else pts[-1]
-            res.append({"lat": nearest["lat"], "lon": nearest["lon"], "ele": nearest["ele"], "time": t})
-        t += timedelta(seconds=1)
-    return res
+def resample_1hz(track):
+    """
+        Interpola el track a 1 Hz (vectorizado con np.interp, que además
+        recorta en los extremos al punto más cercano, igual que hacía el
+        bucle segundo a segundo). Recibe y devuelve Track.
+    """
+    has_t = ~np.isnan(track.t)
+    if has_t.sum() < 2:
+        return Track(track.lat[has_t], track.lon[has_t],
+                     track.ele[has_t], track.t[has_t])
+    order = np.argsort(track.t[has_t], kind="stable")
+    t = track.t[has_t][order]
+    lat = track.lat[has_t][order]
+    lon = track.lon[has_t][order]
+    ele = track.ele[has_t][order]
+    t_grid = np.arange(math.floor(t[0]), math.floor(t[-1]) + 1,
+                       dtype=np.float64)
+    lat_r = np.interp(t_grid, t, lat)
+    lon_r = np.interp(t_grid, t, lon)
+    good = ~np.isnan(ele)
+    ele_r = (np.interp(t_grid, t[good], ele[good]) if good.sum() >= 2
+             else np.full_like(t_grid, math.nan))
+    return Track(lat_r, lon_r, ele_r, t_grid)
 
 # ---------------- Isotonic regression (PAV) ----------------
+@njit(cache=True, fastmath=True)
+def _pav(y, w):
+    """PAV compilado: pila de bloques en arrays preasignados (bw=peso,
+    bs=tiempo*peso, bc=contador) con cota superior n."""
+    n = y.shape[0]
+    y_hat = np.empty(n)
+    bw = np.empty(n)
+    bs = np.empty(n)
+    bc = np.empty(n, dtype=np.int64)
+    top = -1
+    for i in range(n):
+        top += 1
+        bw[top] = w[i]
+        bs[top] = w[i]*y[i]
+        bc[top] = 1
+        # fusiona mientras viole isotonicidad; comparación por producto
+        # cruzado (s1/w1 > s2/w2 <=> s1*w2 > s2*w1) para no dividir
+        while top >= 1 and bs[top-1]*bw[top] > bs[top]*bw[top-1]:
+            bw[top-1] += bw[top]
+            bs[top-1] += bs[top]
+            bc[top-1] += bc[top]
+            top -= 1
+    # expandir
+    k = 0
+    for b in range(top+1):
+        v = bs[b] / bw[b]
+        for _ in range(bc[b]):
+            y_hat[k] = v
+            k += 1
+    return y_hat
+
+@njit(cache=True, fastmath=True)
+def _pav_unweighted(y):
+    """Variante sin pesos de _pav: bloques (suma, contador), sin las
+    multiplicaciones por peso en cada fusión."""
+    n = y.shape[0]
+    y_hat = np.empty(n)
+    bs = np.empty(n)
+    bc = np.empty(n, dtype=np.int64)
+    top = -1
+    for i in range(n):
+        top += 1
+        bs[top] = y[i]
+        bc[top] = 1
+        while top >= 1 and bs[top-1]*bc[top] > bs[top]*bc[top-1]:
+            bs[top-1] += bs[top]
+            bc[top-1] += bc[top]
+            top -= 1
+    k = 0
+    for b in range(top+1):
+        v = bs[b] / bc[b]
+        for _ in range(bc[b]):
+            y_hat[k] = v
+            k += 1
+    return y_hat
+
 def isotonic_increasing(y, w=None):
     """
     Ajusta y_hat no-decreciente que minimiza sum w*(y_hat - y)^2.
-    y: lista de floats (p.ej., tiempos epoch)
-    w: lista de pesos >0 (opcional)
-    Devuelve lista y_hat de igual longitud que y.
+    y: valores (p.ej., tiempos epoch)
+    w: pesos >0 (opcional; sin pesos usa la variante rápida)
+    Devuelve array y_hat de igual longitud que y.
     """
-    n = len(y)
-    if n == 0:
-        return []
+    y = np.asarray(y, dtype=np.float64)
+    if y.shape[0] == 0:
+        return y
     if w is None:
-        w = [1.0]*n
-    # PAV en pila de bloques: cada bloque = (w_sum, y_sum, count)
-    blocks = []
+        return _pav_unweighted(y)
+    return _pav(y, np.asarray(w, dtype=np.float64))
+
+@njit(cache=True)
+def _finalize_times(M, S_pp):
+    """Kernel fusionado del cierre: mediana por columna de la matriz de
+    mapeos (NaN = sin cobertura), relleno de huecos interiores por s,
+    extrapolación en los extremos con la pendiente más cercana y pasada
+    isotónica final, todo en un recorrido sin arrays intermedios.
+
+    Sin fastmath: el kernel depende de la semántica IEEE de NaN
+    (np.isnan) y fastmath la elimina."""
+    n_maps, n = M.shape
+    t = np.empty(n)
+    buf = np.empty(max(1, n_maps))
+    first = -1
+    last = -1
     for i in range(n):
-        blocks.append([w[i], w[i]*y[i], 1]) # [peso, tiempo*peso, counter]	
-        # fusiona mientras viole isotonicidad
-        while len(blocks) >= 2:
-            w2, s2, c2 = blocks[-1]
-            w1, s1, c1 = blocks[-2]
-            if (s1 / w1) <= (s2 / w2): # t1 < t2
-                break
-            # viola: fusionar
-            blocks.pop()
-            blocks.pop()
-            blocks.append([w1+w2, s1+s2, c1+c2])
-    # expandir
-    y_hat = []
-    for w_sum, s_sum, count in blocks:
-        v = s_sum / w_sum
-        y_hat.extend([v]*count)
-    return y_hat
+        m = 0
+        for k in range(n_maps):
+            v = M[k, i]
+            if not np.isnan(v):
+                buf[m] = v
+                m += 1
+        if m == 0:
+            t[i] = np.nan
+        else:
+            c = np.sort(buf[:m])
+            t[i] = c[m//2] if m % 2 == 1 else 0.5*(c[m//2 - 1] + c[m//2])
+            if first < 0:
+                first = i
+            last = i
+    if first < 0:
+        # sin cobertura en ningún punto: todo a 0
+        t[:] = 0.0
+        return t
+    if first == last:
+        # un único punto definido: copia a todo el patrón
+        t[:] = t[first]
+        return t
+    # huecos interiores: interpolación por s entre vecinos válidos
+    p = first
+    for q in range(first+1, last+1):
+        if np.isnan(t[q]):
+            continue
+        if q > p + 1:
+            s0, s1 = S_pp[p], S_pp[q]
+            t0, t1 = t[p], t[q]
+            for i in range(p+1, q):
+                a = 0.0 if s1 == s0 else (S_pp[i] - s0)/(s1 - s0)
+                t[i] = t0 + a*(t1 - t0)
+        p = q
+    # extremos sin cobertura: extrapolación con la pendiente más cercana
+    if first > 0:
+        s0, t0 = S_pp[first], t[first]
+        s1, t1 = S_pp[first+1], t[first+1]
+        slope = 0.0 if s1 == s0 else (t1 - t0)/(s1 - s0)
+        for i in range(first):
+            t[i] = t0 - slope*(s0 - S_pp[i])
+    if last < n - 1:
+        s0, t0 = S_pp[last-1], t[last-1]
+        s1, t1 = S_pp[last], t[last]
+        slope = 0.0 if s1 == s0 else (t1 - t0)/(s1 - s0)
+        for i in range(last+1, n):
+            t[i] = t1 + slope*(S_pp[i] - s1)
+    # pasada isotónica global (garantiza no-decreciente)
+    return _pav_unweighted(t)
 
 # ---------------- Proyección progresiva al patrón ----------------
-def build_pattern_geometry(trp_pts):
-	"""
-	    Dado el patrón (sin tiempos), devuelve:
-	    lat0, lon0: origen de coordenadas
-	    px, py: listas de coordenadas planas (m)
-	    seglen: lista de longitudes de segmentos (m)
-	    S: lista de curvilíneas en vértices (m)
+def build_pattern_geometry(trp):
     """
-    lat0, lon0 = trp_pts[0]["lat"], trp_pts[0]["lon"]
-    px = []; py = []
-    for p in trp_pts:
-        x,y = to_xy(lat0, lon0, p["lat"], p["lon"])
-        px.append(x); py.append(y)
+        Dado el patrón (Track, sin tiempos), devuelve:
+        lat0, lon0: origen de coordenadas
+        px, py: arrays de coordenadas planas (m)
+        VX, VY: vectores de cada segmento (m)
+        VV, invVV: módulo al cuadrado de cada segmento y su inverso
+                   (invVV=1 en segmentos degenerados, que se detectan
+                   con VV == 0)
+        seglen: array de longitudes de segmentos (m)
+        S: array de curvilíneas en vértices (m)
+    """
+    lat0, lon0 = trp.lat[0], trp.lon[0]
+    # Constantes de proyección izadas: un único cos(lat0) para todo el patrón
+    kx = math.cos(math.radians(lat0)) * R_EARTH * math.pi / 180.0
+    ky = R_EARTH * math.pi / 180.0
+    px = (trp.lon - lon0) * kx
+    py = (trp.lat - lat0) * ky
     seglen, S = cumdist(px, py)  # S: curvilínea de vértices del patrón
-    return lat0, lon0, px, py, seglen, S
-
-def closest_vertex_index(px, py, X, Y):
-    best_i, best_d = 0, float("inf")
-    for i in range(len(X)):
-        d = (X[i]-px)**2 + (Y[i]-py)**2
-        if d < best_d:
-            best_d, best_i = d, i
-    return best_i
+    # Geometría de segmentos calculada una sola vez para todas las
+    # grabaciones: la proyección queda en multiplicar-acumular puro
+    VX = np.diff(px)
+    VY = np.diff(py)
+    VV = VX*VX + VY*VY
+    invVV = 1.0 / np.where(VV > 0.0, VV, 1.0)
+    # KD-tree de vértices para sembrar la búsqueda progresiva de cada
+    # grabación en O(log n) en vez de un barrido lineal
+    tree = cKDTree(np.column_stack((px, py)))
+    return lat0, lon0, px, py, VX, VY, VV, invVV, seglen, S, tree
+
+@njit(cache=True, fastmath=True)
+def _project_track(px_arr, py_arr, X, Y, VX, VY, VV, invVV, seglen, S,
+                   j0, back0, ahead0):
+    """Kernel fusionado: proyección progresiva de toda la grabación.
+    Bucle secuencial (la ventana de cada punto depende del anterior)
+    pero sin temporales NumPy por punto: LLVM vectoriza el bucle
+    interno de candidatos. Devuelve (s_out, d_out)."""
+    n = px_arr.shape[0]
+    nseg = seglen.shape[0]
+    s_out = np.empty(n)
+    d_out = np.empty(n)
+    j = j0
+    back = back0
+    ahead = ahead0
+    for k in range(n):
+        px = px_arr[k]
+        py = py_arr[k]
+        i0 = max(0, j - back)
+        i1 = min(nseg - 1, j + ahead)
+        best_d2 = np.inf
+        best_i = i0
+        best_u = 0.0
+        for i in range(i0, i1 + 1):
+            wx = px - X[i]
+            wy = py - Y[i]
+            # Segmento degenerado: proyecta sobre su vértice A (u=0)
+            u = (wx*VX[i] + wy*VY[i]) * invVV[i] if VV[i] > 0.0 else 0.0
+            if u < 0.0:
+                u = 0.0
+            elif u > 1.0:
+                u = 1.0
+            dx = wx - u*VX[i]
+            dy = wy - u*VY[i]
+            d2 = dx*dx + dy*dy
+            if d2 < best_d2:
+                best_d2 = d2
+                best_i = i
+                best_u = u
+        s = S[best_i] + best_u * seglen[best_i]
+        dist = math.sqrt(best_d2)
+        s_out[k] = s
+        d_out[k] = dist
+        # Avanzar la ventana: recentrar en la posición curvilínea real
+        # y adaptar su tamaño — un punto bien enganchado al patrón
+        # explora pocos segmentos; si la proyección se aleja, vuelta a
+        # la ventana completa
+        j = min(nseg - 1, max(0, np.searchsorted(S, s) - 1))
+        if dist < 5.0:
+            back, ahead = 4, 8
+        else:
+            back, ahead = back0, ahead0
+    return s_out, d_out
 
-def project_points_to_pattern(resampled_pts, lat0, lon0, X, Y, seglen, S):
+def project_points_to_pattern(track, lat0, lon0, X, Y, VX, VY, VV, invVV,
+                              seglen, S, tree):
     """
-    Para cada punto (1 Hz) de una grabación, devuelve listas:
-	    s_list (m a lo largo del patrón), 
-	    t_list (time since epoch), 
+    Para cada punto (1 Hz) de una grabación, devuelve arrays:
+	    s_list (m a lo largo del patrón),
+	    t_list (time since epoch),
 	    d_list (m).
-    Usa búsqueda progresiva de mejor segmento con ventana local.
-    
+    Usa búsqueda progresiva de mejor segmento con ventana local
+    (kernel compilado _project_track).
+
     Recibe:
-        resampled_pts: lista de puntos con "lat", "lon", "time"
+        track: grabación resampleada (Track)
         lat0, lon0: origen de coordenadas
-        X, Y: listas de coordenadas planas (m) del patrón
-        seglen: lista de longitudes de segmentos (m)
-        S: lista de curvilíneas en vértices (m)
+        X, Y: arrays de coordenadas planas (m) del patrón
+        VX, VY, VV, invVV: geometría de segmentos (de build_pattern_geometry)
+        seglen: array de longitudes de segmentos (m)
+        S: array de curvilíneas en vértices (m)
+        tree: cKDTree de vértices del patrón (semilla inicial)
     """
     if len(X) < 2:
         return [], [], []
-    # Precalcular por eficiencia
     nseg = len(seglen)
+    # Proyección plana de toda la grabación de una vez (una sola pasada
+    # vectorizada en lugar de un to_xy escalar por segundo)
+    px_arr, py_arr = to_xy(lat0, lon0, track.lat, track.lon)
     # Primer punto: arrancar cerca del vértice más próximo
-    p0 = resampled_pts[0]
-    p0x, p0y = to_xy(lat0, lon0, p0["lat"], p0["lon"])
-    j = max(0, min(nseg-1, closest_vertex_index(p0x, p0y, X, Y)-1))
-    s_list, t_list, d_list = [], [], []
-
-    for p in resampled_pts:
-        t = p["time"].timestamp()
-        px_, py_ = to_xy(lat0, lon0, p["lat"], p["lon"])
-        best = (float("inf"), j, 0.0)  # (dist, seg_idx, u)
-        i0 = max(0, j - SEARCH_BACK)
-        i1 = min(nseg-1, j + SEARCH_AHEAD)
-        for i in range(i0, i1+1):
-            ax, ay = X[i], Y[i]
-            bx, by = X[i+1], Y[i+1]
-            u, qx, qy, dist = proj_on_segment(px_, py_, ax, ay, bx, by, clamp=True)
-            if dist < best[0]:
-                best = (dist, i, u)
-        dist, j, u = best
-        s = S[j] + u * seglen[j]
-        s_list.append(s)
-        t_list.append(t)
-        d_list.append(dist)
-        # Avanzar la ventana favoreciendo movimiento hacia delante
-        # (el índice j ya se queda en el mejor segmento)
-    return s_list, t_list, d_list
+    _, j0 = tree.query((px_arr[0], py_arr[0]))
+    j = max(0, min(nseg-1, int(j0)-1))
+    s_arr, d_arr = _project_track(px_arr, py_arr, X, Y, VX, VY, VV, invVV,
+                                  seglen, S, j, SEARCH_BACK, SEARCH_AHEAD)
+    return s_arr, track.t, d_arr
 
 def weighted_mask(s_list, t_list, d_list, max_dist=MAX_PROJ_DIST):
     """
@@ -255,13 +430,13 @@ def weighted_mask(s_list, t_list, d_list, max_dist=MAX_PROJ_DIST):
         	t_list, momento de cada punto (epoch)
         	d_list, distancias de proyección al patrón
     """
-    s2, t2, w2 = [], [], []
-    for s, t, d in zip(s_list, t_list, d_list):
-        if d <= max_dist:
-            # peso suave, mayor si más cerca (escala ~ 10 m)
-            w = 1.0 / (1.0 + (d/10.0)**2)
-            s2.append(s); t2.append(t); w2.append(w)
-    return s2, t2, w2
+    s = np.asarray(s_list, dtype=np.float64)
+    t = np.asarray(t_list, dtype=np.float64)
+    d = np.asarray(d_list, dtype=np.float64)
+    keep = d <= max_dist
+    # peso suave, mayor si más cerca (escala ~ 10 m)
+    w2 = 1.0 / (1.0 + (d[keep]/10.0)**2)
+    return s[keep], t[keep], w2
 
 def fit_monotone_t_of_s(s_list, t_list, w_list):
     """
@@ -274,37 +449,15 @@ def fit_monotone_t_of_s(s_list, t_list, w_list):
         w_list, lista de pesos de cada punto 
         listas de igual longitud
     """
-    if not s_list:
+    if len(s_list) == 0:
         return [], []
-    order = sorted(range(len(s_list)), key=lambda i: s_list[i])
-    s_sorted = [s_list[i] for i in order]
-    t_sorted = [t_list[i] for i in order]
-    w_sorted = [w_list[i] for i in order]
+    order = np.argsort(s_list, kind="stable")
+    s_sorted = s_list[order]
+    t_sorted = t_list[order]
+    w_sorted = w_list[order]
     t_hat = isotonic_increasing(t_sorted, w_sorted)
     return s_sorted, t_hat
 
-def eval_t_of_s(s_sorted, t_hat, s_query):
-	"""
-    	Evalúa t(s_query) mediante interpolación lineal entre puntos conocidos.
-    	Recibe:
-    	    s_sorted: lista de distancias curvilíneas (m) ordenadas
-    	    t_hat: lista de tiempos (epoch) correspondientes a s_sorted
-    	    s_query: distancia curvilínea del track patrón a evaluar (m)
-    """	
-    if not s_sorted:
-        return None
-    i = bisect.bisect_left(s_sorted, s_query)
-    if i == 0:
-        return None  # fuera por la izquierda: sin extrapolación
-    if i == len(s_sorted):
-        return None  # fuera por la derecha
-    s0, s1 = s_sorted[i-1], s_sorted[i]
-    t0, t1 = t_hat[i-1], t_hat[i]
-    if s1 == s0:
-        return t0
-    a = (s_query - s0) / (s1 - s0)
-    return t0 + a*(t1 - t0)
-
 # ---------------- Pipeline por pasada ----------------
 def process_pasada(pasada_dir):
     base = os.path.basename(pasada_dir.rstrip(os.sep))
@@ -332,7 +485,8 @@ def process_pasada(pasada_dir):
     if len(trp_pts) < 2:
         print(f"[{base}] ❌ Patrón insuficiente.")
         return
-    lat0, lon0, PX, PY, seglen, S_vertices = build_pattern_geometry(trp_pts)
+    (lat0, lon0, PX, PY, VX, VY, VV, invVV,
+     seglen, S_vertices, tree) = build_pattern_geometry(trp_pts)
 
     # Curvilínea de cada punto del patrón (en vértices)
     S_pp = []
@@ -344,17 +498,16 @@ def process_pasada(pasada_dir):
     # ---- Resample y guardar grabaciones ----
     resampled_tracks = []
     for rp in rec_paths:
-        pts = read_gpx_points(rp)
-        pts = [p for p in pts if p["time"] is not None]
-        if len(pts) < 2:
+        tr = read_gpx_points(rp)
+        if (~np.isnan(tr.t)).sum() < 2:
             print(f"[{base}] ⚠️ {os.path.basename(rp)}: menos de 2 puntos con tiempo.")
             continue
-        pts_res = resample_1hz(pts)
-        resampled_tracks.append(pts_res)
+        tr_res = resample_1hz(tr)
+        resampled_tracks.append(tr_res)
         name = os.path.splitext(os.path.basename(rp))[0] + "_resampled"
         out_path = os.path.join(out_dir, f"{name}.gpx")
-        write_gpx_points(out_path, name, pts_res)
-        print(f"[{base}] ✅ Resampleado: {name}.gpx ({len(pts_res)} pts)")
+        write_gpx_points(out_path, name, tr_res)
+        print(f"[{base}] ✅ Resampleado: {name}.gpx ({len(tr_res)} pts)")
 
     if not resampled_tracks:
         print(f"[{base}] ❌ Sin grabaciones resampleadas. Saltando.")
@@ -364,7 +517,9 @@ def process_pasada(pasada_dir):
     mappings = []   # lista de (s_sorted, t_hat)
     coverages = []  # cobertura en % para diagnosticar
     for idx, tr in enumerate(resampled_tracks, 1):
-        s_list, t_list, d_list = project_points_to_pattern(tr, lat0, lon0, PX, PY, seglen, S_vertices)
+        s_list, t_list, d_list = project_points_to_pattern(
+            tr, lat0, lon0, PX, PY, VX, VY, VV, invVV, seglen, S_vertices,
+            tree)
         s_w, t_w, w_w = weighted_mask(s_list, t_list, d_list, MAX_PROJ_DIST)
         s_sorted, t_hat = fit_monotone_t_of_s(s_w, t_w, w_w)
         mappings.append((s_sorted, t_hat))
@@ -374,89 +529,24 @@ def process_pasada(pasada_dir):
         print(f"[{base}] 📈 Mapeo {idx}: {len(s_sorted)} muestras útiles ({cov:.1f}% cobertura)")
 
     # ---- Evaluar tiempos para cada punto del patrón (mediana entre grabaciones) ----
-    def median(vals):
-        vals = sorted(vals)
-        n = len(vals)
-        if n == 0: return None
-        if n % 2 == 1: return vals[n//2]
-        return 0.5*(vals[n//2 - 1] + vals[n//2])
-
-    t_epoch_pp = []
     print(f"[{base}] ⏱ Calculando tiempos del patrón (mediana entre {len(mappings)} mapas)...")
-    for s in tqdm(S_pp, ncols=80, desc=f"{base} t(s)"):
-        cand = []
-        for (s_sorted, t_hat) in mappings: # one tupla per recording
-            t = eval_t_of_s(s_sorted, t_hat, s)
-            if t is not None:
-                cand.append(t)
-        t_epoch_pp.append(median(cand))
-
-    # ---- Relleno/interpolación interna y última pasada isotónica ----
-    # Interpolar huecos internos por s (si hay None entre valores válidos)
-    # Construimos arrays de s y t con válidos
-    valid = [(s, t) for s, t in zip(S_pp, t_epoch_pp) if t is not None]
-    if len(valid) >= 2:
-        s_valid = [s for s,_ in valid]
-        t_valid = [t for _,t in valid]
-        # Para cada None, interpola entre vecinos válidos
-        for i, (s, t) in enumerate(zip(S_pp, t_epoch_pp)):
-            if t is None:
-                j = bisect.bisect_left(s_valid, s)
-                if 0 < j < len(s_valid):
-                    s0, s1 = s_valid[j-1], s_valid[j]
-                    t0, t1 = t_valid[j-1], t_valid[j]
-                    a = 0.0 if s1==s0 else (s - s0)/(s1 - s0)
-                    t_epoch_pp[i] = t0 + a*(t1 - t0)
-        # Para extremos sin cobertura, extrapola linealmente con la pendiente más cercana
-        # (opcional) — si siguen quedando None:
-        first_defined = next((i for i,t in enumerate(t_epoch_pp) if t is not None), None)
-        last_defined  = next((i for i in range(len(t_epoch_pp)-1, -1, -1) if t_epoch_pp[i] is not None), None)
-        if first_defined is not None and last_defined is not None:
-            # Extrapola a la izquierda
-            if first_defined+1 <= last_defined:
-                s0, t0 = S_pp[first_defined], t_epoch_pp[first_defined]
-                s1, t1 = S_pp[first_defined+1], t_epoch_pp[first_defined+1]
-                slope = 0.0 if s1==s0 else (t1 - t0)/(s1 - s0)
-                for i in range(first_defined-1, -1, -1):
-                    t_epoch_pp[i] = t0 - slope*(s0 - S_pp[i])
-            # Extrapola a la derecha
-            if last_defined-1 >= 0:
-                s0, t0 = S_pp[last_defined-1], t_epoch_pp[last_defined-1]
-                s1, t1 = S_pp[last_defined], t_epoch_pp[last_defined]
-                slope = 0.0 if s1==s0 else (t1 - t0)/(s1 - s0)
-                for i in range(last_defined+1, len(S_pp)):
-                    t_epoch_pp[i] = t1 + slope*(S_pp[i] - s1)
-
-    # Última pasada isotónica global (garantiza no-decreciente)
-    t_vals = [t if t is not None else float("nan") for t in t_epoch_pp]
-    # Rellena NaN (si quedara alguno) con interpolación simple por índice
-    # para poder aplicar isotónica; en la práctica con la extrapolación previa no deberían quedar.
-    if any(math.isnan(v) for v in t_vals):
-        # fallback simple: copia vecino más cercano definido
-        for i in range(len(t_vals)):
-            if math.isnan(t_vals[i]):
-                # busca anterior
-                j = i-1
-                while j >=0 and math.isnan(t_vals[j]): j -= 1
-                k = i+1
-                while k < len(t_vals) and math.isnan(t_vals[k]): k += 1
-                if (j >= 0 and k < len(t_vals)):
-                    t_vals[i] = 0.5*(t_vals[j]+t_vals[k])
-                elif j >= 0:
-                    t_vals[i] = t_vals[j]
-                elif k < len(t_vals):
-                    t_vals[i] = t_vals[k]
-                else:
-                    t_vals[i] = 0.0
-    # Ajuste isotónico final sobre t(s)
-    t_hat_final = isotonic_increasing(t_vals, [1.0]*len(t_vals))
-    # Construir puntos alineados
-    aligned = []
-    for p, te in zip(trp_pts, t_hat_final):
-        aligned.append({
-            "lat": p["lat"], "lon": p["lon"], "ele": p.get("ele"),
-            "time": datetime.fromtimestamp(te, tz=timezone.utc)
-        })
+    # Cada mapeo se evalúa sobre todo S_pp de una vez con np.interp y la
+    # mediana entre grabaciones sale de un único np.nanmedian por columnas.
+    # Fuera del rango cubierto por un mapeo (s <= s_min o s > s_max, como
+    # en eval_t_of_s) queda NaN y no cuenta para la mediana.
+    M = np.full((len(mappings), len(S_pp)), np.nan)
+    for k, (s_sorted, t_hat) in enumerate(mappings):  # una fila por grabación
+        if len(s_sorted) == 0:
+            continue
+        s_sorted = np.asarray(s_sorted, dtype=np.float64)
+        t_hat = np.asarray(t_hat, dtype=np.float64)
+        inside = (S_pp > s_sorted[0]) & (S_pp <= s_sorted[-1])
+        M[k, inside] = np.interp(S_pp[inside], s_sorted, t_hat)
+
+    # ---- Mediana, relleno, extrapolación e isotónica final fusionados ----
+    t_hat_final = _finalize_times(M, S_pp)
+    # Construir el patrón alineado: misma geometría, tiempos ajustados
+    aligned = Track(trp_pts.lat, trp_pts.lon, trp_pts.ele, t_hat_final)
 
     # Guardar patrón alineado
     pattern_name = os.path.splitext(os.path.basename(trp_path))[0]
@@ -472,9 +562,13 @@ def main():
         print(f"❌ No existe {RAW_DIR}")
         return
     pasadas = [d for d in sorted(os.listdir(RAW_DIR)) if os.path.isdir(os.path.join(RAW_DIR, d))]
+    pasada_paths = [os.path.join(RAW_DIR, p) for p in pasadas]
     print(f"📂 Encontradas {len(pasadas)} pasadas en {RAW_DIR}")
-    for pasada in pasadas:
-        process_pasada(os.path.join(RAW_DIR, pasada))
+    # Cada pasada es independiente (lee y escribe en su propio directorio):
+    # se reparten entre procesos. _pav está cacheado (cache=True), así que
+    # los workers no recompilan el kernel.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        list(ex.map(process_pasada, pasada_paths))
 
 if __name__ == "__main__":
     main()
@@ -21,10 +21,14 @@ data/
 """
 
 import os
+import sys
+import math
 import glob
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import gpxpy
-import gpxpy.gpx
-from datetime import datetime, timedelta, timezone
+import numpy as np
+from datetime import datetime, timezone
 from tqdm import tqdm
 
 RAW_DIR = os.path.join("data", "preprocessed")
@@ -54,71 +58,67 @@ def read_gpx_points(path):
     return pts
 
 
+def _format_gpx_time(t):
+    """Formatea un datetime como tiempo GPX (ISO-8601 con Z)."""
+    if t.microsecond:
+        frac = f".{t.microsecond:06d}".rstrip("0")
+        return t.strftime("%Y-%m-%dT%H:%M:%S") + frac + "Z"
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
 def write_gpx_points(path, name, points):
-    """Escribe puntos en un GPX."""
-    gpx = gpxpy.gpx.GPX()
-    trk = gpxpy.gpx.GPXTrack(name=name)
-    gpx.tracks.append(trk)
-    seg = gpxpy.gpx.GPXTrackSegment()
-    trk.segments.append(seg)
+    """Escribe puntos en un GPX (serialización directa con str.join,
+    sin construir objetos gpxpy por punto)."""
+    rows = []
     for p in points:
-        seg.points.append(gpxpy.gpx.GPXTrackPoint(
-            p["lat"], p["lon"], elevation=p.get("ele"), time=p.get("time")
-        ))
+        s = f'      <trkpt lat="{float(p["lat"])!r}" lon="{float(p["lon"])!r}">'
+        ele = p.get("ele")
+        if ele is not None:
+            s += f"<ele>{float(ele)!r}</ele>"
+        t = p.get("time")
+        if t is not None:
+            s += f"<time>{_format_gpx_time(t)}</time>"
+        s += "</trkpt>"
+        rows.append(s)
+    body = "\n".join(rows)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        f.write(gpx.to_xml())
-
-
-def interpolate_point(pA, pB, t_target):
-    """Interpola posición linealmente entre pA y pB para el tiempo t_target."""
-    tA, tB = pA["time"], pB["time"]
-    total = (tB - tA).total_seconds()
-    if total <= 0:
-        return {
-            "lat": pA["lat"], "lon": pA["lon"],
-            "ele": pA["ele"], "time": t_target
-        }
-    alpha = (t_target - tA).total_seconds() / total
-    alpha = max(0.0, min(1.0, alpha))
-    lat = pA["lat"] + alpha * (pB["lat"] - pA["lat"])
-    lon = pA["lon"] + alpha * (pB["lon"] - pA["lon"])
-    ele = None
-    if pA["ele"] is not None and pB["ele"] is not None:
-        ele = pA["ele"] + alpha * (pB["ele"] - pA["ele"])
-    return {"lat": lat, "lon": lon, "ele": ele, "time": t_target}
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" '
+                'creator="tracks-preprocess">\n'
+                f"  <trk>\n    <name>{name}</name>\n    <trkseg>\n"
+                f"{body}\n"
+                "    </trkseg>\n  </trk>\n</gpx>\n")
 
 
 def resample_1hz(points):
-    """Interpola el track a 1 Hz."""
+    """Interpola el track a 1 Hz (vectorizado con np.interp)."""
     pts = [p for p in points if p["time"] is not None]
     if len(pts) < 2:
         return pts
     pts = sorted(pts, key=lambda p: p["time"])
-    t0 = pts[0]["time"].replace(microsecond=0)
-    t1 = pts[-1]["time"].replace(microsecond=0)
+    t = np.array([p["time"].timestamp() for p in pts])
+    lat = np.array([p["lat"] for p in pts])
+    lon = np.array([p["lon"] for p in pts])
+    ele = np.array([p["ele"] if p["ele"] is not None else math.nan
+                    for p in pts])
+    t_grid = np.arange(int(t[0]), int(t[-1]) + 1, dtype=np.float64)
+    lat_r = np.interp(t_grid, t, lat)
+    lon_r = np.interp(t_grid, t, lon)
+    good = ~np.isnan(ele)
+    ele_r = np.interp(t_grid, t[good], ele[good]) if good.sum() >= 2 else None
     resampled = []
-    i = 0
-    t = t0
-    while t <= t1:
-        while i + 1 < len(pts) and pts[i+1]["time"] < t:
-            i += 1
-        if i + 1 < len(pts) and pts[i]["time"] <= t <= pts[i+1]["time"]:
-            resampled.append(interpolate_point(pts[i], pts[i+1], t))
-        else:
-            # fuera de rango: usar el más cercano
-            nearest = pts[0] if t < pts[0]["time"] else pts[-1]
-            resampled.append({
-                "lat": nearest["lat"],
-                "lon": nearest["lon"],
-                "ele": nearest["ele"],
-                "time": t
-            })
-        t += timedelta(seconds=1)
+    for i, ts in enumerate(t_grid):
+        resampled.append({
+            "lat": lat_r[i],
+            "lon": lon_r[i],
+            "ele": ele_r[i] if ele_r is not None else None,
+            "time": datetime.fromtimestamp(ts, tz=timezone.utc)
+        })
     return resampled
 
 
-def process_pasada(pasada_dir):
+def process_pasada(pasada_dir, force=False):
     base = os.path.basename(pasada_dir.rstrip(os.sep))
     print(f"\n🔹 Procesando pasada: {base}")
     os.makedirs(os.path.join(PRE_DIR, base), exist_ok=True)
@@ -129,6 +129,14 @@ def process_pasada(pasada_dir):
         return
     trp_path = pattern_files[0]
 
+    # Ejecución incremental: no reprocesar si la salida es más reciente
+    out_path = os.path.join(PRE_DIR, base,
+                            os.path.basename(trp_path).replace(".gpx", "_resampled.gpx"))
+    if (not force and os.path.exists(out_path)
+            and os.path.getmtime(out_path) > os.path.getmtime(trp_path)):
+        print(f"[{base}] ⏩ Salida al día. Saltando.")
+        return
+
     pts = read_gpx_points(trp_path)
     if not pts:
         print(f"[{base}] ⚠️ Patrón vacío")
@@ -136,23 +144,25 @@ def process_pasada(pasada_dir):
 
     print(f"[{base}] ⏱ Resampleando {len(pts)} puntos → 1 Hz...")
     pts_resampled = resample_1hz(pts)
-    out_path = os.path.join(PRE_DIR, base,
-                            os.path.basename(trp_path).replace(".gpx", "_resampled.gpx"))
     write_gpx_points(out_path, os.path.basename(out_path), pts_resampled)
     print(f"[{base}] ✅ Guardado: {out_path} ({len(pts_resampled)} puntos)")
 
 
 def main():
+    force = "--force" in sys.argv[1:]
     if not os.path.isdir(RAW_DIR):
         print(f"❌ No existe {RAW_DIR}")
         return
 
     pasadas = [d for d in sorted(os.listdir(RAW_DIR))
                if os.path.isdir(os.path.join(RAW_DIR, d))]
+    pasada_paths = [os.path.join(RAW_DIR, p) for p in pasadas]
 
     print(f"📂 Encontradas {len(pasadas)} pasadas")
-    for pasada in tqdm(pasadas, desc="Procesando pasadas"):
-        process_pasada(os.path.join(RAW_DIR, pasada))
+    # Pasadas independientes: se reparten entre procesos.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        list(tqdm(ex.map(process_pasada, pasada_paths, repeat(force)),
+                  total=len(pasada_paths), desc="Procesando pasadas"))
 
 
 if __name__ == "__main__":